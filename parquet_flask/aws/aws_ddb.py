@@ -13,11 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import decimal
+import functools
+import itertools
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config as BotoConfig
 
 from parquet_flask.aws.aws_cred import AwsCred
 
@@ -25,6 +34,45 @@ LOGGER = logging.getLogger(__name__)
 
 VALID_KEY_TYPE = ['S', 'N', 'B']
 
+# larger pool for parallel scans and batch writes. default is 10 connections
+_DDB_CLIENT_CONFIG = BotoConfig(max_pool_connections=64, retries={'max_attempts': 10, 'mode': 'adaptive'}, tcp_keepalive=True)
+_DDB_TABLES = {}
+_DDB_TABLE_DETAILS = {}  # {(session_key, tbl_name): (expiry in time.monotonic(), describe_table result)}
+_DDB_TABLE_DETAILS_TTL = 300
+_DDB_TABLES_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_ddb_client(session_key: tuple):
+    """
+    boto3 clients are expensive to create and thread-safe. sharing 1 per session settings (region + cred)
+
+    :param session_key: tuple - sorted items of AwsCred.boto3_session
+    :return: DynamoDB client
+    """
+    return boto3.Session(**dict(session_key)).client('dynamodb', config=_DDB_CLIENT_CONFIG)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_ddb_resource(session_key: tuple):
+    return boto3.Session(**dict(session_key)).resource('dynamodb', config=_DDB_CLIENT_CONFIG)
+
+
+def _reset_after_fork():
+    """
+    connection pools of boto3 clients must not be shared with forked worker processes
+    """
+    global _DDB_TABLES_LOCK
+    _get_ddb_client.cache_clear()
+    _get_ddb_resource.cache_clear()
+    _DDB_TABLES.clear()
+    _DDB_TABLE_DETAILS.clear()
+    _DDB_TABLES_LOCK = threading.Lock()
+    return
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
 
 class AwsDdbProps:
     def __init__(self):
@@ -108,18 +156,64 @@ class AwsDdb(AwsCred):
     def __init__(self, props=AwsDdbProps()):
         super().__init__()
         self.__props = props
-        self._ddb_client = self.get_client('dynamodb')
-        self._ddb_resource = self.get_resource('dynamodb')
+        self.__session_key = tuple(sorted(self.boto3_session.items()))
+        self._ddb_client = _get_ddb_client(self.__session_key)
+        self._ddb_resource = _get_ddb_resource(self.__session_key)
+        self.__table = None
+        self._hash_attr = Attr(self.__props.hash_key) if self.__props.hash_key is not None else None
+        self._range_attr = Attr(self.__props.range_key) if self.__props.range_key is not None else None
+
+    def __get_table(self):
+        table_key = (self.__session_key, self.__props.tbl_name)
+        with _DDB_TABLES_LOCK:
+            if table_key not in _DDB_TABLES:
+                _DDB_TABLES[table_key] = self._ddb_resource.Table(self.__props.tbl_name)
+            return _DDB_TABLES[table_key]
+
+    @property
+    def _table(self):
+        """
+        Table handle of props.tbl_name. re-retrieved only when tbl_name is changed.
+        """
+        if self.__table is None or self.__table.name != self.__props.tbl_name:
+            self.__table = self.__get_table() if self.__props.tbl_name is not None else None
+        return self.__table
+
+    @staticmethod
+    def invalidate_table_cache(tbl_name):
+        """
+        removing cached has_table results of a table. needed after the table is created or deleted.
+
+        :param tbl_name: str
+        :return: None
+        """
+        with _DDB_TABLES_LOCK:
+            for each_key in [k for k in _DDB_TABLE_DETAILS if k[1] == tbl_name]:
+                _DDB_TABLE_DETAILS.pop(each_key)
+        return
 
     def has_table(self):
+        """
+        describe_table result is cached for _DDB_TABLE_DETAILS_TTL seconds. missing tables are cached as None.
+
+        :return: dict - describe_table result, or None if the table does not exist
+        """
         if self.__props.tbl_name is None:
             raise ValueError('missing tbl_name')
+        table_key = (self.__session_key, self.__props.tbl_name)
+        with _DDB_TABLES_LOCK:
+            if table_key in _DDB_TABLE_DETAILS and _DDB_TABLE_DETAILS[table_key][0] > time.monotonic():
+                return _DDB_TABLE_DETAILS[table_key][1]
         try:
             tbl_details = self._ddb_client.describe_table(TableName=self.__props.tbl_name)
-            return tbl_details
+        except self._ddb_client.exceptions.ResourceNotFoundException:
+            tbl_details = None
         except Exception as e:
-            # TODO should check if exception is this one "ResourceNotFoundException". if not, throw the error
+            LOGGER.warning(f'unable to describe table: {self.__props.tbl_name}. not caching the result. {e}')
             return None
+        with _DDB_TABLES_LOCK:
+            _DDB_TABLE_DETAILS[table_key] = (time.monotonic() + _DDB_TABLE_DETAILS_TTL, tbl_details)
+        return tbl_details
 
     def create_table(self, gsi_list=[]):
         """
@@ -169,10 +263,16 @@ class AwsDdb(AwsCred):
         if len(gsi_list) > 0:
             create_tbl_params['GlobalSecondaryIndexes'] = gsi_list
         create_result = self._ddb_client.create_table(**create_tbl_params)
+        self.invalidate_table_cache(self.__props.tbl_name)
         return create_result
 
+    @staticmethod
+    def __decimal_to_number(decimal_val):
+        return int(decimal_val) if decimal_val % 1 == 0 else float(decimal_val)
+
     def _replace_decimals(self, obj):
         """
+        replacing Decimal with int or float in place, walking nested dict and list without recursion.
         Ref:
             https://stackoverflow.com/a/46738251  in the comments
             https://github.com/boto/boto3/issues/369#issuecomment-157205696
@@ -180,21 +280,21 @@ class AwsDdb(AwsCred):
         :param obj:
         :return:
         """
-        if isinstance(obj, list):
-            for i in range(len(obj)):
-                obj[i] = self._replace_decimals(obj[i])
-            return obj
-        elif isinstance(obj, dict):
-            for k in obj.keys():
-                obj[k] = self._replace_decimals(obj[k])
-            return obj
-        elif isinstance(obj, decimal.Decimal):
-            if obj % 1 == 0:
-                return int(obj)
-            else:
-                return float(obj)
-        else:
+        obj_type = type(obj)
+        if obj_type is decimal.Decimal:
+            return self.__decimal_to_number(obj)
+        if obj_type is not dict and obj_type is not list:
             return obj
+        worklist = collections.deque([obj])
+        while worklist:
+            container = worklist.pop()
+            for k, v in (container.items() if type(container) is dict else enumerate(container)):
+                v_type = type(v)
+                if v_type is decimal.Decimal:
+                    container[k] = self.__decimal_to_number(v)
+                elif v_type is dict or v_type is list:
+                    worklist.append(v)
+        return obj
 
     def get_one_item(self, hash_val, range_val=None):
         """
@@ -207,7 +307,7 @@ class AwsDdb(AwsCred):
         query_key = {self.__props.hash_key: hash_val}
         if range_val is not None and self.__props.range_key is not None:
             query_key[self.__props.range_key] = range_val
-        item_result = self._ddb_resource.Table(self.__props.tbl_name).get_item(
+        item_result = self._table.get_item(
             Key=query_key
         )
         if 'Item' not in item_result:
@@ -229,13 +329,49 @@ class AwsDdb(AwsCred):
         query_key = {self.__props.hash_key: hash_val}
         if range_val is not None and self.__props.range_key is not None:
             query_key[self.__props.range_key] = range_val
-        item_result = self._ddb_resource.Table(self.__props.tbl_name).delete_item(Key=query_key, ReturnValues='ALL_OLD')
+        item_result = self._table.delete_item(Key=query_key, ReturnValues='ALL_OLD')
         if 'Attributes' not in item_result:
             LOGGER.warning('cannot retrieved deleted attributes.')
             return None
         return item_result['Attributes']
 
-    def add_one_item(self, item_dict, hash_val, range_val=None, replace=False):
+    def add_items(self, items, hash_key_fn, range_key_fn=None):
+        """
+        adding items with BatchWriteItem (25 items per request). unprocessed items are retried by boto3.
+
+        NOTE: BatchWriteItem does not support ConditionExpression. existing items with the same keys are overwritten.
+
+        :param items: list - list of item dictionaries
+        :param hash_key_fn: function - item_dict -> hash value
+        :param range_key_fn: function - item_dict -> range value (optional)
+        :return: None
+        """
+        LOGGER.info(f'adding {len(items)} items to DDB in batches')
+        # range key is part of the primary key even if the items already have it. otherwise, items with
+        # the same hash key and different range keys are de-duplicated by the batch writer
+        primary_keys = [self.__props.hash_key]
+        if self.__props.range_key is not None:
+            primary_keys.append(self.__props.range_key)
+        with self._table.batch_writer(overwrite_by_pkeys=primary_keys) as batch_writer:
+            for each_item in items:
+                each_item[self.__props.hash_key] = hash_key_fn(each_item)
+                if range_key_fn is not None and self.__props.range_key is not None:
+                    each_item[self.__props.range_key] = range_key_fn(each_item)
+                batch_writer.put_item(Item=each_item)
+        return
+
+    def add_one_item(self, item_dict, hash_val, range_val=None, replace=False, conditional=True):
+        """
+        :param item_dict: dict - item to be added
+        :param hash_val:
+        :param range_val:
+        :param replace: bool - if conditional, item must exist when replacing, and must not exist when adding
+        :param conditional: bool - False to skip the existence condition and write via add_items
+        :return: None
+        """
+        if conditional is False:
+            self.add_items([item_dict], lambda _: hash_val, None if range_val is None else lambda _: range_val)
+            return
         LOGGER.info('adding one item from DDB using they key')
         item_dict[self.__props.hash_key] = hash_val
         if range_val is not None and self.__props.range_key is not None:
@@ -246,38 +382,104 @@ class AwsDdb(AwsCred):
             'ReturnValues': 'ALL_OLD',
         }
         if replace is True:
-            if range_val is not None and self.__props.range_key is not None:
-                condition = Attr(self.__props.hash_key).eq(hash_val) and Attr(self.__props.range_key).ne(range_val)
+            if range_val is not None and self._range_attr is not None:
+                condition = self._hash_attr.eq(hash_val) & self._range_attr.ne(range_val)
             else:
-                condition = Attr(self.__props.hash_key).eq(hash_val)
+                condition = self._hash_attr.eq(hash_val)
         else:
-            if range_val is not None and self.__props.range_key is not None:
-                condition = Attr(self.__props.hash_key).ne(hash_val) and Attr(self.__props.range_key).ne(range_val)
+            if range_val is not None and self._range_attr is not None:
+                condition = self._hash_attr.ne(hash_val) & self._range_attr.ne(range_val)
             else:
-                condition = Attr(self.__props.hash_key).ne(hash_val)
+                condition = self._hash_attr.ne(hash_val)
         addition_arguments['ConditionExpression'] = condition
-        item_result = self._ddb_resource.Table(self.__props.tbl_name).put_item(**addition_arguments)
+        item_result = self._table.put_item(**addition_arguments)
         """
         {'ResponseMetadata': {'RequestId': '49876A3IFHPMRFIEUMANGFAO8VVV4KQNSO5AEMVJF66Q9ASUAAJG', 'HTTPStatusCode': 200, 'HTTPHeaders': {'server': 'Server', 'date': 'Mon, 08 Mar 2021 17:58:08 GMT', 'content-type': 'application/x-amz-json-1.0', 'content-length': '2', 'connection': 'keep-alive', 'x-amzn-requestid': '49876A3IFHPMRFIEUMANGFAO8VVV4KQNSO5AEMVJF66Q9ASUAAJG', 'x-amz-crc32': '2745614147'}, 'RetryAttempts': 0}}
         """
         # TODO check result
         return
 
-    def scan_tbl(self, conditions_dict):
-        LOGGER.info('scanning items from DDB using they key')
-        current_tbl = self._ddb_resource.Table(self.__props.tbl_name)
-        item_result = current_tbl.scan(
-            Limit=1,
-            ScanFilter=conditions_dict,
-            Select='ALL_ATTRIBUTES')
-        all_results = item_result['Items']
+    def _scan_segment(self, scan_filter, segment, total_segments, page_size=1000):
+        """
+        scanning one segment of a parallel scan till there is no more LastEvaluatedKey.
+        using the client since it is thread-safe, unlike the Table resource shared by the segments.
+
+        :param scan_filter: dict - ScanFilter with DynamoDB typed values
+        :param segment: int - 0 based segment index
+        :param total_segments: int - total number of segments
+        :param page_size: int - max number of items to evaluate per scan request
+        :return: list - items from this segment with Decimal numbers
+        """
+        scan_params = {
+            'TableName': self.__props.tbl_name,
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'ScanFilter': scan_filter,
+            'Select': 'ALL_ATTRIBUTES',
+            'Limit': page_size,
+        }
+        item_result = self._ddb_client.scan(**scan_params)
+        segment_results = item_result['Items']
         while 'LastEvaluatedKey' in item_result and item_result['LastEvaluatedKey'] is not None:  # pagination
-            item_result = current_tbl.scan(
-                Limit=100,
-                ScanFilter=conditions_dict,
-                ExclusiveStartKey=item_result['LastEvaluatedKey'],
-                Select='ALL_ATTRIBUTES')
+            item_result = self._ddb_client.scan(ExclusiveStartKey=item_result['LastEvaluatedKey'], **scan_params)
+            segment_results.extend(item_result['Items'])
+        deserializer = TypeDeserializer()
+        return [{k: deserializer.deserialize(v) for k, v in each_item.items()} for each_item in segment_results]
+
+    def scan_tbl(self, conditions_dict, parallel_segments=8):
+        """
+        parallel scan. each segment is paginated in its own thread.
+        ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Scan.html#Scan.ParallelScan
+
+        :param conditions_dict: dict - ScanFilter with python values. example: {'s3_url': {'AttributeValueList': ['s3://...'], 'ComparisonOperator': 'EQ'}}
+        :param parallel_segments: int - number of segments (and threads) to scan the table with
+        :return: list - all items matching the conditions
+        """
+        LOGGER.info('scanning items from DDB using they key')
+        serializer = TypeSerializer()
+        scan_filter = {}
+        for k, v in conditions_dict.items():
+            scan_filter[k] = dict(v)
+            if 'AttributeValueList' in v:  # missing for NULL and NOT_NULL
+                scan_filter[k]['AttributeValueList'] = [serializer.serialize(each_val) for each_val in v['AttributeValueList']]
+        with ThreadPoolExecutor(max_workers=parallel_segments) as executor:
+            segment_futures = [executor.submit(self._scan_segment, scan_filter, each_segment, parallel_segments)
+                               for each_segment in range(parallel_segments)]
+            segment_results = [k.result() for k in as_completed(segment_futures)]
+        return self._replace_decimals(list(itertools.chain.from_iterable(segment_results)))
+
+    def query_items(self, key_condition, filter_expression=None, limit=None, index_name=None):
+        """
+        query items by key condition. Use this instead of scan_tbl when there is a hash key predicate.
+        ref: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.query
+
+        :param key_condition: boto3.dynamodb.conditions.Key condition. example: Key('s3_url').eq('s3://...')
+        :param filter_expression: boto3.dynamodb.conditions.Attr condition (optional)
+        :param limit: int - max number of items to return. None to retrieve all pages
+        :param index_name: str - name of a secondary index (optional)
+        :return: list - matching items
+        """
+        LOGGER.info('querying items from DDB using key condition')
+        query_params = {
+            'KeyConditionExpression': key_condition,
+            'Select': 'ALL_ATTRIBUTES',
+        }
+        if filter_expression is not None:
+            query_params['FilterExpression'] = filter_expression
+        if index_name is not None:
+            query_params['IndexName'] = index_name
+        current_tbl = self._table
+        all_results = []
+        while True:
+            if limit is not None:
+                query_params['Limit'] = limit - len(all_results)
+            item_result = current_tbl.query(**query_params)
             all_results.extend(item_result['Items'])
+            if limit is not None and len(all_results) >= limit:
+                break
+            if 'LastEvaluatedKey' not in item_result or item_result['LastEvaluatedKey'] is None:  # pagination
+                break
+            query_params['ExclusiveStartKey'] = item_result['LastEvaluatedKey']
         return self._replace_decimals(all_results)
 
     def update_one_item(self, update_expression, expression_names, expression_vals, hash_val, range_val=None, retrieve_new_val=True):
@@ -297,7 +499,7 @@ ddb.update_one_item('SET #created_at_key = #created_at_key + :created_at_val', {
         query_key = {self.__props.hash_key: hash_val}
         if range_val is not None and self.__props.range_key is not None:
             query_key[self.__props.range_key] = range_val
-        item_result = self._ddb_resource.Table(self.__props.tbl_name).update_item(
+        item_result = self._table.update_item(
             Key=query_key,
             UpdateExpression=update_expression,
             ExpressionAttributeNames=expression_names,
@@ -322,14 +524,13 @@ ddb.update_one_item('SET #created_at_key = #created_at_key + :created_at_val', {
         :param hash_dict: dictionary of {'name': 'value'} of a hash key. Only 1 is allowed
         :return:
         """
-        hash_val = [v for v in hash_dict.values()][0]
+        hash_key, hash_val = next(iter(hash_dict.items()))
         query_dict = {
             'IndexName': index_name,
             'Select': 'ALL_ATTRIBUTES',  # 'ALL_ATTRIBUTES'|'ALL_PROJECTED_ATTRIBUTES'|'SPECIFIC_ATTRIBUTES'|'COUNT'
             'Limit': 1,
             'ConsistentRead': False,
-            'KeyConditionExpression': boto3.dynamodb.conditions.Key([k for k in hash_dict.keys()][0]).between(hash_val),
+            'KeyConditionExpression': Key(hash_key).eq(hash_val),
         }
-        item_result = self._ddb_resource.Table(self.__props.tbl_name).query(**query_dict)
-        updated_result = [self._replace_decimals(k) for k in item_result['Items']]
-        return updated_result
+        item_result = self._table.query(**query_dict)
+        return self._replace_decimals(item_result['Items'])
@@ -13,27 +13,93 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import logging
 import os
 from io import BytesIO
 
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+
 from parquet_flask.aws.aws_cred import AwsCred
 from parquet_flask.utils.file_utils import FileUtils
 
 LOGGER = logging.getLogger(__name__)
+# large pool for the multipart download threads of concurrent requests. keep-alive for long-lived idle connections
+_S3_CLIENT_CONFIG = BotoConfig(max_pool_connections=64, retries={'max_attempts': 10, 'mode': 'adaptive'}, tcp_keepalive=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_s3_client(session_key: tuple):
+    """
+    boto3 clients are expensive to create and thread-safe. sharing 1 per session settings (region + cred)
+    so that the connections (and their TLS handshakes) are re-used across requests.
+
+    :param session_key: tuple - sorted items of AwsCred.boto3_session
+    :return: S3 client
+    """
+    return boto3.Session(**dict(session_key)).client('s3', config=_S3_CLIENT_CONFIG)
+
+
+os.register_at_fork(after_in_child=_get_s3_client.cache_clear)
+
+
+class _HashingWriter:
+    """
+    write-only file object which updates the hasher with each chunk before writing it.
+    It is not seekable, so that boto3 writes the downloaded chunks in order.
+    If abort_event is set, the next write raises so that boto3 cancels the rest of the download.
+    """
+    def __init__(self, file_obj, hasher, abort_event=None):
+        self.__file_obj = file_obj
+        self.__hasher = hasher
+        self.__abort_event = abort_event
+
+    def write(self, data):
+        if self.__abort_event is not None and self.__abort_event.is_set():
+            raise ValueError('download is aborted')
+        self.__hasher.update(data)
+        return self.__file_obj.write(data)
 
 
 class AwsS3(AwsCred):
-    def __init__(self):
+    def __init__(self, s3_client=None):
+        """
+        :param s3_client: boto3 S3 client. default to the shared client of the current session settings
+        """
         super().__init__()
         self.__valid_s3_schemas = ['s3://', 's3a://', 's3s://']
-        self.__s3_client = self.get_client('s3')
+        self.__s3_client = _get_s3_client(tuple(sorted(self.boto3_session.items()))) if s3_client is None else s3_client
         self.__target_bucket = None
         self.__target_key = None
+        self.__transfer_config = TransferConfig(multipart_threshold=8 * 2**20, multipart_chunksize=16 * 2**20,
+                                                max_concurrency=10, use_threads=True)
+
+    def set_transfer_config(self, **kwargs):
+        """
+        overriding the multipart transfer settings used by downloads
+        ref: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/customizations/s3.html#boto3.s3.transfer.TransferConfig
+
+        :param kwargs: TransferConfig arguments. example: max_concurrency=20
+        :return: self
+        """
+        self.__transfer_config = TransferConfig(**kwargs)
+        return self
 
     def get_s3_stream(self):
         return self.__s3_client.get_object(Bucket=self.__target_bucket, Key=self.__target_key)['Body']
 
+    def get_small_object(self, s3_url):
+        """
+        reading a small S3 object in 1 GET request. no HEAD request is needed beforehand.
+
+        :param s3_url: str - s3://bucket/key
+        :return: bytes - object contents
+        """
+        self.set_s3_url(s3_url)
+        return self.get_s3_stream().read()
+
     def read_small_txt_file(self):
         """
         convenient method to read small text files stored in S3
@@ -129,14 +195,43 @@ class AwsS3(AwsCred):
         self.__tag_existing_obj(all_tags)
         return True
 
-    def download(self, local_dir, file_name=None):
+    def __get_local_file_path(self, local_dir, file_name=None):
         if not FileUtils.dir_exist(local_dir):
             raise ValueError('missing directory')
         if file_name is None:
             LOGGER.debug(f'setting the downloading filename from target_key: {self.__target_key}')
             file_name = os.path.basename(self.__target_key)
-        local_file_path = os.path.join(local_dir, file_name)
+        return os.path.join(local_dir, file_name)
+
+    def download_with_hash(self, local_dir, file_name=None, hasher=None, abort_event=None):
+        """
+        downloading the file while hashing the downloaded bytes so that the file does not need to be read again.
+        the partial file is deleted if the download fails or is aborted.
+        gzipped objects are written as they are. they are decompressed while being read. (FileUtils.read_json)
+
+        :param local_dir:
+        :param file_name: default to the basename of the S3 key
+        :param hasher: hashlib object. default to sha512
+        :param abort_event: threading.Event - setting it from another thread aborts the download
+        :return: tuple - (local_file_path, hex digest of the S3 object)
+        """
+        hasher = FileUtils.new_sha512() if hasher is None else hasher
+        local_file_path = self.__get_local_file_path(local_dir, file_name)
+        LOGGER.debug(f'downloading with hash to local_file_path: {local_file_path}')
+        try:
+            with open(local_file_path, 'wb') as ff:
+                self.__s3_client.download_fileobj(self.__target_bucket, self.__target_key,
+                                                  _HashingWriter(ff, hasher, abort_event),
+                                                  Config=self.__transfer_config)
+        except Exception:
+            FileUtils.del_file(local_file_path)
+            raise
+        LOGGER.debug('file downloaded')
+        return local_file_path, hasher.hexdigest()
+
+    def download(self, local_dir, file_name=None):
+        local_file_path = self.__get_local_file_path(local_dir, file_name)
         LOGGER.debug(f'downloading to local_file_path: {local_file_path}')
-        self.__s3_client.download_file(self.__target_bucket, self.__target_key, local_file_path)
+        self.__s3_client.download_file(self.__target_bucket, self.__target_key, local_file_path, Config=self.__transfer_config)
         LOGGER.debug(f'file downloaded')
         return local_file_path
@@ -1,6 +1,11 @@
+import functools
+import json
+
 from pyspark.sql.types import StructType, StructField, DoubleType, StringType, MapType, LongType, TimestampType, \
     IntegerType
 
+from parquet_flask.utils.file_utils import FileUtils
+
 
 class CdmsSchema:
     ALL_SCHEMA = StructType([
@@ -95,3 +100,88 @@ class CdmsSchema:
 
         StructField('device', StringType(), True),
     ])
+
+    @staticmethod
+    def __get_non_null_types(json_schema_property: dict):
+        """
+        :param json_schema_property: dict - property of the json schema. `type` is either a str or a list of str
+        :return: list - types other than `null`. `string` if `type` is missing
+        """
+        property_type = json_schema_property['type'] if 'type' in json_schema_property else 'string'
+        property_types = property_type if isinstance(property_type, list) else [property_type]
+        return [k for k in property_types if k != 'null']
+
+    @staticmethod
+    def __get_spark_type(json_schema_property: dict):
+        non_null_types = CdmsSchema.__get_non_null_types(json_schema_property)
+        if len(non_null_types) != 1:  # mixed types like meta. non-string values are stored as json strings
+            return StringType()
+        property_type = non_null_types[0]
+        if property_type == 'number':
+            return DoubleType()
+        if property_type == 'integer':
+            return LongType()
+        if property_type == 'object':
+            return MapType(StringType(), StringType())
+        return StringType()
+
+    @staticmethod
+    def __get_observation_properties(json_schema_path):
+        """
+        :param json_schema_path: str - path to in_situ_schema.json
+        :return: list - (column name, property) of an observation record. `$ref` is resolved
+        """
+        json_schema = FileUtils.read_json(json_schema_path)
+        if json_schema is None:
+            raise ValueError(f'invalid json_schema file: {json_schema_path}')
+        definitions = json_schema['definitions']
+        observation_properties = []
+        for k, v in definitions['observation']['properties'].items():
+            if '$ref' in v:
+                v = definitions[v['$ref'].split('/')[-1]]
+            observation_properties.append((k, v))
+        return observation_properties
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_observation_schema(json_schema_path) -> StructType:
+        """
+        spark schema of an observation record, built once from the in-situ json schema file
+        so that spark does not need to infer it from the data.
+
+        :param json_schema_path: str - path to in_situ_schema.json
+        :return: StructType
+        """
+        return StructType([StructField(k, CdmsSchema.__get_spark_type(v), True)
+                           for k, v in CdmsSchema.__get_observation_properties(json_schema_path)])
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_json_str_columns(json_schema_path) -> tuple:
+        """
+        columns with mixed types (e.g. meta: string or object). they are StringType in the spark schema.
+
+        :param json_schema_path: str - path to in_situ_schema.json
+        :return: tuple - column names
+        """
+        return tuple(k for k, v in CdmsSchema.__get_observation_properties(json_schema_path)
+                     if len(CdmsSchema.__get_non_null_types(v)) > 1)
+
+    @staticmethod
+    def serialize_json_str_columns(observations, json_schema_path):
+        """
+        converting the object and array values of the mixed type columns to json strings in place,
+        so that they match the StringType columns. spark rejects them otherwise.
+
+        :param observations: list - observation dicts
+        :param json_schema_path: str - path to in_situ_schema.json
+        :return: list - the same observations
+        """
+        json_str_columns = CdmsSchema.get_json_str_columns(json_schema_path)
+        if len(json_str_columns) < 1:
+            return observations
+        for observation in observations:
+            for column in json_str_columns:
+                if isinstance(observation.get(column), (dict, list)):
+                    observation[column] = json.dumps(observation[column])
+        return observations
@@ -13,19 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import logging
+import threading
 
 from pyspark.sql.dataframe import DataFrame
 
+try:
+    import pandas as pd
+    import pyarrow  # noqa: F401 spark converts pandas data frames with arrow. without it, NaN is rejected in LongType columns
+except ImportError:
+    pd = None
+
 from parquet_flask.io_logic.cdms_constants import CDMSConstants
+from parquet_flask.io_logic.cdms_schema import CdmsSchema
 from parquet_flask.io_logic.retrieve_spark_session import RetrieveSparkSession
 from parquet_flask.io_logic.sanitize_record import SanitizeRecord
+from parquet_flask.io_logic.spark_constants import SparkConstants
 from parquet_flask.utils.config import Config
 from parquet_flask.utils.file_utils import FileUtils
+from parquet_flask.utils.general_utils import GeneralUtils
 
 from pyspark.sql.functions import to_timestamp, year, month, lit
+from pyspark.sql.types import StructType, StructField, TimestampType, IntegerType, StringType
 
 LOGGER = logging.getLogger(__name__)
+# spark conf is shared by the threads of this process. keeping them from restoring each other's arrow fallback value
+_ARROW_FALLBACK_LOCK = threading.Lock()
 
 
 class IngestNewJsonFile:
@@ -36,7 +50,63 @@ class IngestNewJsonFile:
         self.__master_spark = config.get_value('master_spark_url')
         self.__mode = 'overwrite' if is_overwriting else 'append'
         self.__parquet_name = config.get_value('parquet_file_name')
+        self.__compression = config.get_value(Config.parquet_compression, 'gzip')  # zstd needs spark >= 3.2 (parquet-mr >= 1.12)
         self.__sanitize_record = True
+        self.__batch_size = None
+        self.__write_parallelism = None
+        self.__enable_dictionary = True
+
+    @property
+    def compression(self):
+        return self.__compression
+
+    @compression.setter
+    def compression(self, val):
+        """
+        :param val: str - parquet compression codec. zstd snappy gzip
+        :return: None
+        """
+        self.__compression = val
+        return
+
+    @property
+    def enable_dictionary(self):
+        return self.__enable_dictionary
+
+    @enable_dictionary.setter
+    def enable_dictionary(self, val):
+        """
+        :param val: bool - dictionary (RLE encoded) pages for columns with repeated values such as platform_code
+        :return: None
+        """
+        self.__enable_dictionary = val
+        return
+
+    @property
+    def write_parallelism(self):
+        return self.__write_parallelism
+
+    @write_parallelism.setter
+    def write_parallelism(self, val):
+        """
+        :param val: int - number of tasks writing the parquet partitions concurrently. None to use spark default
+        :return: None
+        """
+        self.__write_parallelism = val
+        return
+
+    @property
+    def batch_size(self):
+        return self.__batch_size
+
+    @batch_size.setter
+    def batch_size(self, val):
+        """
+        :param val: int - number of observations converted to spark at a time. None to convert all at once.
+        :return: None
+        """
+        self.__batch_size = val
+        return
 
     @property
     def sanitize_record(self):
@@ -52,23 +122,87 @@ class IngestNewJsonFile:
         return
 
     @staticmethod
-    def create_df(spark_session, data_list, job_id, provider, project):
-        LOGGER.debug(f'creating data frame with length {len(data_list)}')
-        df = spark_session.createDataFrame(data_list)
-        LOGGER.debug(f'adding columns')
-        df: DataFrame = df.withColumn(CDMSConstants.time_obj_col, to_timestamp(CDMSConstants.time_col))\
+    def __create_pandas_df(data_list, observation_schema: StructType):
+        """
+        adding derived columns in pandas so that spark can convert the columns with arrow
+        instead of pickling each row of python dicts.
+
+        :param data_list: list - observations
+        :param observation_schema: StructType - schema of the observations
+        :return: tuple - (pandas.DataFrame, StructType) columns are in the same order as the schema
+        """
+        # reindex first so that optional columns missing in all observations are null as in the schema-based path
+        pdf = pd.DataFrame(data_list).reindex(columns=observation_schema.fieldNames())
+        time_obj = pd.to_datetime(pdf[CDMSConstants.time_col], utc=True, errors='coerce')
+        pdf[CDMSConstants.time_obj_col] = time_obj
+        pdf[CDMSConstants.year_col] = time_obj.dt.year.astype('Int32')
+        pdf[CDMSConstants.month_col] = time_obj.dt.month.astype('Int32')
+        pdf[CDMSConstants.platform_code_col] = pdf[CDMSConstants.platform_col].map(
+            lambda platform: platform.get(CDMSConstants.code_col) if isinstance(platform, dict) else None)
+        pdf_schema = StructType(observation_schema.fields + [
+            StructField(CDMSConstants.time_obj_col, TimestampType(), True),
+            StructField(CDMSConstants.year_col, IntegerType(), True),
+            StructField(CDMSConstants.month_col, IntegerType(), True),
+            StructField(CDMSConstants.platform_code_col, StringType(), True),
+        ])
+        return pdf, pdf_schema
+
+    @staticmethod
+    def __create_arrow_df(spark_session, data_list, observation_schema: StructType):
+        """
+        the row-based fallback of spark rejects NaN in LongType columns.
+        so the fallback is disabled only while converting, and the arrow error is raised instead.
+        """
+        pdf, pdf_schema = IngestNewJsonFile.__create_pandas_df(data_list, observation_schema)
+        with _ARROW_FALLBACK_LOCK:
+            previous_fallback = spark_session.conf.get(SparkConstants.ARROW_FALLBACK_KEY, 'true')
+            spark_session.conf.set(SparkConstants.ARROW_FALLBACK_KEY, 'false')
+            try:
+                return spark_session.createDataFrame(pdf, pdf_schema)
+            finally:
+                spark_session.conf.set(SparkConstants.ARROW_FALLBACK_KEY, previous_fallback)
+
+    @staticmethod
+    def __create_observation_df(spark_session, data_list, observation_schema: StructType):
+        if pd is not None:
+            return IngestNewJsonFile.__create_arrow_df(spark_session, data_list, observation_schema)
+        df = spark_session.createDataFrame(data_list, schema=observation_schema)
+        return df.withColumn(CDMSConstants.time_obj_col, to_timestamp(CDMSConstants.time_col))\
             .withColumn(CDMSConstants.year_col, year(CDMSConstants.time_col))\
             .withColumn(CDMSConstants.month_col, month(CDMSConstants.time_col))\
-            .withColumn(CDMSConstants.platform_code_col, df[CDMSConstants.platform_col][CDMSConstants.code_col])\
-            .withColumn(CDMSConstants.job_id_col, lit(job_id))\
+            .withColumn(CDMSConstants.platform_code_col, df[CDMSConstants.platform_col][CDMSConstants.code_col])
+
+    @staticmethod
+    def create_df(spark_session, data_list, job_id, provider, project, batch_size=None, write_parallelism=None):
+        """
+        :param spark_session:
+        :param data_list: list - observations. object values of the mixed type columns (e.g. meta) are converted to json strings in place
+        :param job_id:
+        :param provider:
+        :param project:
+        :param batch_size: int - number of observations converted to spark at a time. None to convert all at once.
+                            batches are combined, and still written in 1 job.
+        :param write_parallelism: int - number of tasks writing the parquet partitions concurrently.
+                            None to use spark.sql.shuffle.partitions
+        :return: DataFrameWriter
+        """
+        LOGGER.debug(f'creating data frame with length {len(data_list)}. batch_size: {batch_size}')
+        json_schema_path = Config().get_value(Config.in_situ_schema)
+        observation_schema = CdmsSchema.get_observation_schema(json_schema_path)
+        data_list = CdmsSchema.serialize_json_str_columns(data_list, json_schema_path)
+        data_batches = [data_list] if batch_size is None else GeneralUtils.chunk_list(data_list, batch_size)
+        df = functools.reduce(DataFrame.union, [IngestNewJsonFile.__create_observation_df(spark_session, k, observation_schema)
+                                                for k in data_batches])
+        LOGGER.debug(f'adding columns')
+        df: DataFrame = df.withColumn(CDMSConstants.job_id_col, lit(job_id))\
             .withColumn(CDMSConstants.provider_col, lit(provider))\
-            .withColumn(CDMSConstants.project_col, lit(project))\
-            .repartition(1)  # combine to 1 data frame to increase size
+            .withColumn(CDMSConstants.project_col, lit(project))
             # .withColumn('ingested_date', lit(TimeUtils.get_current_time_str()))
         LOGGER.debug(f'create writer')
         all_partitions = [CDMSConstants.provider_col, CDMSConstants.project_col, CDMSConstants.platform_code_col,
                           CDMSConstants.year_col, CDMSConstants.month_col, CDMSConstants.job_id_col]
-        df = df.repartition(1)
+        # rows of the same parquet partition end up in 1 task (1 file per partition) while partitions are written in parallel
+        df = df.repartitionByRange(*all_partitions) if write_parallelism is None else df.repartitionByRange(write_parallelism, *all_partitions)
         df_writer = df.write
         LOGGER.debug(f'create partitions')
         df_writer = df_writer.partitionBy(all_partitions)
@@ -85,20 +219,23 @@ class IngestNewJsonFile:
         :param job_id:
         :return: int - number of records
         """
-        if not FileUtils.file_exist(abs_file_path):
-            raise ValueError('missing file to ingest it. path: {}'.format(abs_file_path))
         LOGGER.debug(f'sanitizing the files ? : {self.__sanitize_record}')
-        if self.sanitize_record is True:
-            input_json = SanitizeRecord(Config().get_value('in_situ_schema')).start(abs_file_path)
-        else:
-            if not FileUtils.file_exist(abs_file_path):
-                raise ValueError('json file does not exist: {}'.format(abs_file_path))
-            input_json = FileUtils.read_json(abs_file_path)
+        try:
+            if self.sanitize_record is True:
+                input_json = SanitizeRecord(Config().get_value('in_situ_schema')).start(abs_file_path)
+            else:
+                input_json = FileUtils.read_json(abs_file_path)
+        except FileNotFoundError:
+            raise ValueError('missing file to ingest it. path: {}'.format(abs_file_path))
         df_writer = self.create_df(self.__sss.retrieve_spark_session(self.__app_name, self.__master_spark),
                                    input_json[CDMSConstants.observations_key],
                                    job_id,
                                    input_json[CDMSConstants.provider_col],
-                                   input_json[CDMSConstants.project_col])
-        df_writer.mode(self.__mode).parquet(self.__parquet_name, compression='GZIP')  # snappy GZIP
+                                   input_json[CDMSConstants.project_col],
+                                   self.__batch_size,
+                                   self.__write_parallelism)
+        df_writer.mode(self.__mode)\
+            .option('parquet.enable.dictionary', str(self.__enable_dictionary).lower())\
+            .parquet(self.__parquet_name, compression=self.__compression)  # zstd snappy gzip
         LOGGER.debug(f'finished writing parquet')
         return len(input_json[CDMSConstants.observations_key])
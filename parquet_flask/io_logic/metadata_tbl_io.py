@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import threading
+
 from parquet_flask.aws.aws_ddb import AwsDdb, AwsDdbProps
 from parquet_flask.io_logic.cdms_constants import CDMSConstants
 from parquet_flask.io_logic.metadata_tbl_interface import MetadataTblInterface
@@ -33,6 +36,29 @@ class MetadataTblIO(MetadataTblInterface):
         s3_url as primary key
         secondary index: uuid
     """
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """
+        shared instance per process so that the ddb client and table handle are created only once.
+        MetadataTblIO is stateless after __init__. so it is safe to share across requests.
+
+        :return: MetadataTblIO
+        """
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls()
+        return cls.__instance
+
+    @classmethod
+    def _reset_instance(cls):
+        cls.__instance = None
+        cls.__instance_lock = threading.Lock()
+        return
+
     def __init__(self):
         ddb_props = AwsDdbProps()
         ddb_props.hash_key = CDMSConstants.s3_url_key
@@ -56,3 +82,6 @@ class MetadataTblIO(MetadataTblInterface):
 
     def query_by_date_range(self, start_time, end_time):
         raise NotImplementedError('cannot implement range query to the primary key in DDB')
+
+
+os.register_at_fork(after_in_child=MetadataTblIO._reset_instance)
@@ -35,6 +35,7 @@ class ReplaceJsonFile:
         self.__master_spark = config.get_value('master_spark_url')
         self.__mode = 'overwrite'
         self.__parquet_name = config.get_value('parquet_file_name')
+        self.__compression = config.get_value(Config.parquet_compression, 'gzip')  # zstd needs spark >= 3.2 (parquet-mr >= 1.12)
 
     def ingest(self, abs_file_path, job_id):
         """
@@ -57,6 +58,6 @@ class ReplaceJsonFile:
                                                 job_id,
                                                 input_json[CDMSConstants.provider_col],
                                                 input_json[CDMSConstants.project_col])
-        df_writer.mode(self.__mode).parquet(self.__parquet_name, compression='GZIP')
+        df_writer.mode(self.__mode).parquet(self.__parquet_name, compression=self.__compression)  # zstd snappy gzip
         LOGGER.debug(f'finished writing parquet')
         return len(input_json[CDMSConstants.observations_key])
@@ -37,6 +37,7 @@ class RetrieveSparkSession(metaclass=Singleton):
             'spark.hadoop.fs.s3a.impl': 'org.apache.hadoop.fs.s3a.S3AFileSystem',
             SparkConstants.CRED_PROVIDER_KEY: SparkConstants.SIMPLE_CRED,  # should be overridden
             'spark.hadoop.fs.s3a.connection.ssl.enabled': 'true',
+            'spark.sql.execution.arrow.pyspark.enabled': 'true',  # pandas -> spark data frame via arrow. only used if pyarrow is installed
 
             # old configs. no longer needs to be used
             # 'spark.driver.extraJavaOptions': '-Dcom.amazonaws.services.s3.enableV4=true',
@@ -100,6 +101,13 @@ spark.hadoop.fs.s3n.impl                org.apache.hadoop.fs.s3native.NativeS3Fi
         self.__sparks[session_key] = SparkSession.builder.appName(app_name).config(conf=conf).master(master_spark).getOrCreate()
         return self.__sparks[session_key]
 
+    def retrieve_default_spark_session(self) -> SparkSession:
+        """
+        session of spark_app_name and master_spark_url from config. used to start spark before the 1st request.
+        """
+        config = Config()
+        return self.retrieve_spark_session(config.get_value(Config.spark_app_name), config.get_value(Config.master_spark_url))
+
     def stop_spark_session(self, app_name, master_spark):
         session_key = '{}__{}'.format(app_name, master_spark)
         if session_key in self.__sparks:
@@ -59,14 +59,12 @@ class SanitizeRecord:
             raise ValueError('json_schema file does not exist: {}'.format(json_schema_path))
         self.__json_schema = FileUtils.read_json(json_schema_path)
         self.__schema_key_values = {k: v for k, v in self.__json_schema['definitions']['observation']['properties'].items()}
+        self.__number_keys = frozenset([k for k, v in self.__schema_key_values.items() if 'type' in v and v['type'] == 'number'])
         self.__parallel_json_validator = ParallelJsonValidator()
 
     def __sanitize_record(self, data_blk):
-        for k, v in data_blk.items():
-            if k in self.__schema_key_values and \
-                    'type' in self.__schema_key_values[k] and \
-                    self.__schema_key_values[k]['type'] == 'number':
-                data_blk[k] = float(v)
+        for k in self.__number_keys.intersection(data_blk):
+            data_blk[k] = float(data_blk[k])
         return
 
     def __validate_json(self, data):
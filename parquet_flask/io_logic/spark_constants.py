@@ -6,3 +6,5 @@ class SparkConstants:
     CRED_ACCESS_KEY = 'spark.hadoop.fs.s3a.access.key'
     CRED_SECRET_KEY = 'spark.hadoop.fs.s3a.secret.key'
     CRED_TOKEN_KEY = 'spark.hadoop.fs.s3a.session.token'
+
+    ARROW_FALLBACK_KEY = 'spark.sql.execution.arrow.pyspark.fallback.enabled'
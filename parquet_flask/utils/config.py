@@ -34,6 +34,8 @@ class Config(metaclass=Singleton):
     authentication_type = 'authentication_type'
     authentication_key = 'authentication_key'
     flask_prefix = 'flask_prefix'
+    parquet_compression = 'parquet_compression'
+    ingest_pool_size = 'ingest_pool_size'
 
     def __init__(self):
         self.__keys = [
@@ -51,6 +53,8 @@ class Config(metaclass=Singleton):
             Config.aws_access_key_id,
             Config.aws_secret_access_key,
             Config.aws_session_token,
+            Config.parquet_compression,
+            Config.ingest_pool_size,
         ]
         self.__validate()
 
@@ -13,13 +13,90 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
 import hashlib
 import json
+import math
+import mmap
 import os
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
-from subprocess import Popen, PIPE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+SHA512 = 'sha512'
+BLAKE3 = 'blake3'
+XXH3_128 = 'xxh3_128'
+FASTEST_CHECKSUM_ALGORITHM = BLAKE3 if blake3 is not None else XXH3_128 if xxhash is not None else SHA512
+
+
+def _json_loads(json_buffer):
+    """
+    orjson (or ujson) when installed. falling back to the standard library for inputs they reject, like NaN.
+
+    :param json_buffer: bytes-like object. orjson reads it without copying.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(json_buffer)
+        except orjson.JSONDecodeError:
+            return json.loads(bytes(json_buffer))
+    if ujson is not None:
+        try:
+            return ujson.loads(bytes(json_buffer))
+        except ValueError:
+            return json.loads(bytes(json_buffer))
+    return json.loads(bytes(json_buffer))
+
+
+def _has_non_finite_float(json_obj):
+    """
+    iterative so that deeply nested objects do not hit the recursion limit.
+    """
+    pending = [json_obj]
+    while pending:
+        current = pending.pop()
+        if isinstance(current, float):
+            if not math.isfinite(current):
+                return True
+        elif isinstance(current, dict):
+            pending.extend(current.values())
+        elif isinstance(current, (list, tuple)):
+            pending.extend(current)
+    return False
+
+
+def _json_dumps(json_obj, prettify=False):
+    """
+    compact output without spaces, or prettified with 4 spaces.
+    orjson when installed. the standard library, with the same separators, for what orjson cannot write:
+    non-str keys, and NaN / Infinity which orjson writes as null.
+    """
+    if prettify:
+        return json.dumps(json_obj, indent=4).encode()
+    if orjson is not None and not _has_non_finite_float(json_obj):
+        try:
+            return orjson.dumps(json_obj)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(json_obj, separators=(',', ':'), ensure_ascii=False).encode()
 
 
 class FileUtils:
@@ -28,31 +105,125 @@ class FileUtils:
         Path(dir_path).mkdir(parents=True, exist_ok=True)
         return
 
+    @staticmethod
+    def gunzip_to_stream(zipped_file_path):
+        """
+        :param zipped_file_path:
+        :return: gzip.GzipFile - binary file object with decompressed content. caller should close it.
+        :raises FileNotFoundError: if the file is missing
+        """
+        return gzip.open(zipped_file_path, 'rb')
+
     @staticmethod
     def gunzip_file_os(zipped_file_path, output_file_path=None):
-        if not FileUtils.file_exist(zipped_file_path):
-            raise ValueError('missing file: {}'.format(zipped_file_path))
-        session = Popen(['gunzip', zipped_file_path], stdout=PIPE, stderr=PIPE)
-        stdout, stderr = session.communicate()
-        if stderr:
-            raise RuntimeError('error while gunzipping the file with Popen. filename: {}. error: {}'.format(zipped_file_path, stderr))
-        default_output_path = zipped_file_path[:-3]
-        if not FileUtils.file_exist(default_output_path):
-            raise ValueError('missing gunzipped file: {}'.format(default_output_path))
+        """
+        decompressing in-process. similar to `gunzip`, the zipped file is removed after it is decompressed.
+
+        :param zipped_file_path:
+        :param output_file_path: default to zipped_file_path without `.gz`
+        :return: output_file_path
+        """
         if output_file_path is None:
-            output_file_path = default_output_path
-        if FileUtils.file_exist(output_file_path) and default_output_path != output_file_path:
-            os.renames(default_output_path, output_file_path)
+            output_file_path = zipped_file_path[:-3]
+        try:
+            src = open(zipped_file_path, 'rb')
+        except FileNotFoundError:
+            raise ValueError('missing file to unzip it. path: {}'.format(zipped_file_path))
+        decompressor = None
+        try:
+            with src, open(output_file_path, 'wb') as dest:
+                chunk = src.read(2**20)
+                while chunk:
+                    if decompressor is None or decompressor.eof:  # 1st or next gzip member
+                        decompressor = zlib.decompressobj(wbits=31)
+                    dest.write(decompressor.decompress(chunk, 2**24))  # bounding memory for highly compressed chunks
+                    chunk = (decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail) or src.read(2**20)
+            if decompressor is None or not decompressor.eof:
+                raise ValueError('incomplete gzip file. path: {}'.format(zipped_file_path))
+        except zlib.error as e:
+            FileUtils.del_file(output_file_path)
+            raise ValueError('invalid gzip file. path: {}. details: {}'.format(zipped_file_path, str(e)))
+        except ValueError:
+            FileUtils.del_file(output_file_path)
+            raise
+        FileUtils.del_file(zipped_file_path)
         return output_file_path
 
     @staticmethod
-    def get_checksum(file_path):
+    def new_sha512(data=b''):
+        """
+        sha512 from OpenSSL (SHA-NI / AVX2 / ARMv8 code paths) marked as not used for security
+        so that it is allowed in FIPS mode. python < 3.9 does not have `usedforsecurity`.
+
+        :param data: bytes-like object
+        :return: hashlib object
+        """
+        try:
+            return hashlib.new(SHA512, data, usedforsecurity=False)
+        except TypeError:
+            return hashlib.new(SHA512, data)
+
+    @staticmethod
+    def get_checksum(file_path, algorithm=SHA512):
+        """
+        :param file_path:
+        :param algorithm: str - sha512 (default), blake3, or xxh3_128.
+                            blake3 and xxh3_128 are integrity-only and need the optional `blake3` or `xxhash` package.
+                            FASTEST_CHECKSUM_ALGORITHM is the fastest one installed.
+        :return: str - hex digest
+        """
+        if algorithm == BLAKE3:
+            if blake3 is None:
+                raise ValueError('blake3 is not installed')
+            d = blake3.blake3(max_threads=blake3.blake3.AUTO)
+            d.update_mmap(file_path)
+            return d.hexdigest()
+        if algorithm == XXH3_128:
+            if xxhash is None:
+                raise ValueError('xxhash is not installed')
+            d = xxhash.xxh3_128()
+        elif algorithm == SHA512:
+            d = FileUtils.new_sha512()
+        else:
+            raise ValueError(f'unknown checksum algorithm: {algorithm}')
         with open(file_path, mode='rb') as f:
-            d = hashlib.sha512()
-            for buf in iter(partial(f.read, 512 * 2**10), b''):
-                d.update(buf)
+            if algorithm == SHA512 and hasattr(hashlib, 'file_digest'):  # python 3.11+
+                return hashlib.file_digest(f, FileUtils.new_sha512).hexdigest()
+            buf = bytearray(2**20)  # re-using 1 buffer instead of allocating bytes per chunk
+            mv = memoryview(buf)
+            for n in iter(partial(f.readinto, buf), 0):
+                d.update(mv[:n])
         return d.hexdigest()
 
+    @staticmethod
+    def __get_range_digest(file_view, offset, length):
+        with file_view[offset: offset + length] as range_view:  # zero-copy slice of the mapped file
+            return FileUtils.new_sha512(range_view).digest()
+
+    @staticmethod
+    def get_checksum_fast(file_path, shards=os.cpu_count()):
+        """
+        hashing `shards` equal ranges of the memory-mapped file in parallel threads and combining them as
+        sha512(sha512(range_1) + sha512(range_2) + ...)
+
+        NOTE: result is NOT the same as get_checksum, and it depends on the number of shards.
+        Use get_checksum to compare against existing sha512 values.
+
+        :param file_path:
+        :param shards: int - number of ranges (and threads)
+        :return: str - hex digest
+        """
+        file_size = FileUtils.get_size(file_path)
+        if file_size == 0:  # empty file cannot be memory-mapped
+            return FileUtils.new_sha512().hexdigest()
+        shards = max(1, shards or 1)
+        shard_size = max(1, -(-file_size // shards))  # ceiling division
+        ranges = [(k, min(shard_size, file_size - k)) for k in range(0, file_size, shard_size)]
+        with open(file_path, mode='rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+            with ThreadPoolExecutor(max_workers=shards) as executor:
+                sub_digests = list(executor.map(lambda r: FileUtils.__get_range_digest(mv, *r), ranges))
+        return FileUtils.new_sha512(b''.join(sub_digests)).hexdigest()
+
     @staticmethod
     def get_size(file_path):
         return os.stat(file_path).st_size
@@ -73,18 +244,31 @@ class FileUtils:
 
     @staticmethod
     def read_json(path):
-        with open(path, 'r') as ff:
+        """
+        gzipped files (ending with `.gz`) are decompressed in memory without writing the decompressed file.
+
+        :param path:
+        :return: json object. None if it is invalid
+        :raises FileNotFoundError: if the file is missing
+        """
+        if str(path).lower().endswith('.gz'):
+            with FileUtils.gunzip_to_stream(path) as ff:
+                try:
+                    return _json_loads(ff.read())
+                except (ValueError, OSError, EOFError):  # invalid json or invalid gzip
+                    return None
+        with open(path, 'rb') as ff:
             try:
-                return json.loads(ff.read())
-            except:
+                with mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+                    return _json_loads(mv)
+            except ValueError:  # invalid json or empty file
                 return None
 
     @staticmethod
     def write_json(file_path, json_obj, overwrite=False, append=False, prettify=False):
         if os.path.exists(file_path) and not overwrite:
             raise ValueError('{} already exists, and not overwriting'.format(file_path))
-        with open(file_path, 'a' if append else 'w') as ff:
-            json_str = json.dumps(json_obj, indent=4) if prettify else json.dumps(json_obj)
-            ff.write(json_str)
+        with open(file_path, 'ab' if append else 'wb') as ff:
+            ff.write(_json_dumps(json_obj, prettify))
             pass
         return
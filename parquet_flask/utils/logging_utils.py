@@ -0,0 +1,52 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import sys
+
+
+class LoggingUtils:
+    LOG_FILE = '/tmp/parquet_flask.log'
+
+    @staticmethod
+    def setup_logging():
+        """
+        logging to LOG_FILE and stdout with `log_level` env variable (default: INFO).
+        used by the flask server and by the spawned ingest worker processes as they do not inherit the handlers.
+
+        :return: None
+        """
+        log_format = '%(asctime)s [%(levelname)s] [%(name)s::%(lineno)d] %(message)s'
+        log_formatter = logging.Formatter(log_format)
+        log_level = getattr(logging, os.getenv('log_level', 'INFO').upper(), None)
+        if not isinstance(log_level, int):
+            print(f'invalid log_level:{log_level}. setting to INFO')
+            log_level = logging.INFO
+
+        file_handler = logging.FileHandler(LoggingUtils.LOG_FILE, mode='a')
+        file_handler.setLevel(log_level)
+        file_handler.setFormatter(log_formatter)
+
+        stream_handler = logging.StreamHandler(stream=sys.stdout)
+        stream_handler.setLevel(level=log_level)
+        stream_handler.setFormatter(log_formatter)
+
+        logging.basicConfig(
+            level=log_level,
+            format=log_format,
+            handlers=[file_handler, stream_handler]
+        )
+        return
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 from datetime import datetime
 
 
@@ -23,7 +24,10 @@ class TimeUtils:
 
     @staticmethod
     def get_current_time_unix():
-        return int(datetime.utcnow().timestamp() * 1000)
+        """
+        :return: int - current unix time in milliseconds
+        """
+        return time.time_ns() // 1_000_000
 
     @staticmethod
     def get_datetime_obj(dt_str, fmt='%Y-%m-%dT%H:%M:%SZ'):
@@ -13,149 +13,206 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hmac
 import logging
-import os
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
 import uuid
-from multiprocessing.context import Process
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Union
+
+from botocore.exceptions import ClientError
 
 from parquet_flask.aws.aws_s3 import AwsS3
 from parquet_flask.io_logic.cdms_constants import CDMSConstants
 from parquet_flask.io_logic.ingest_new_file import IngestNewJsonFile
 from parquet_flask.io_logic.metadata_tbl_io import MetadataTblIO
+from parquet_flask.utils.config import Config
 from parquet_flask.utils.file_utils import FileUtils
+from parquet_flask.utils.logging_utils import LoggingUtils
 from parquet_flask.utils.time_utils import TimeUtils
 
 LOGGER = logging.getLogger(__name__)
 
 
-class IngestAwsJsonProps:
-    def __init__(self):
-        self.__s3_url = None
-        self.__s3_sha_url = None
-        self.__uuid = str(uuid.uuid4())
-        self.__working_dir = f'/tmp/{str(uuid.uuid4())}'
-        self.__is_replacing = False
-        self.__is_sanitizing = True
-        self.__wait_till_complete = True
-
-    @property
-    def wait_till_complete(self):
-        return self.__wait_till_complete
+def _init_ingest_worker():
+    """
+    setting up the same logging as the server since spawned workers do not inherit its handlers.
+    spark is not started here. IngestNewJsonFile starts it in the 1st background ingestion of the worker,
+    so that idle workers do not hold a spark driver (and its executors) in the cluster.
+    """
+    LoggingUtils.setup_logging()
+    return
 
-    @wait_till_complete.setter
-    def wait_till_complete(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__wait_till_complete = val
-        return
 
-    @property
-    def is_sanitizing(self):
-        return self.__is_sanitizing
+def _new_ingest_pool():
+    """
+    each worker runs its own spark driver. so the pool is kept small. (ingest_pool_size from config. default: 1)
+    spawn instead of fork so that the workers do not inherit the py4j gateway of the spark session in this process
+    """
+    pool_size = int(Config().get_value(Config.ingest_pool_size, '1'))
+    return ProcessPoolExecutor(max_workers=pool_size, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_ingest_worker)
 
-    @is_sanitizing.setter
-    def is_sanitizing(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__is_sanitizing = val
-        return
 
-    @property
-    def s3_sha_url(self):
-        return self.__s3_sha_url
+# re-using worker processes for background ingestion instead of starting a new process per request.
+# created by the 1st background ingestion, so that it is not created by importing this module. (e.g. in the workers)
+_INGEST_POOL = None
+_INGEST_POOL_LOCK = threading.Lock()
 
-    @s3_sha_url.setter
-    def s3_sha_url(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__s3_sha_url = val
-        return
 
-    @property
-    def is_replacing(self):
-        return self.__is_replacing
+@dataclass
+class IngestAwsJsonProps:
+    """
+    settings of 1 ingestion request.
+    compression: parquet compression codec. None to use parquet_compression from config (default: gzip)
+    enable_dictionary: dictionary (RLE encoded) pages for columns with repeated values
+    write_parallelism: number of tasks writing the parquet partitions concurrently. None to use spark default
+    batch_size: number of observations converted to spark at a time. None to convert all at once.
+    speculative_download: downloading the S3 file while checking the metadata table. the download is aborted if the check fails
+    """
+    s3_url: Union[str, None] = None
+    s3_sha_url: Union[str, None] = None
+    uuid: str = field(default_factory=lambda: str(uuid.uuid4()))
+    working_dir: Union[str, None] = field(default=None, init=False)  # temporary directory created by IngestAwsJson.ingest
+    is_replacing: bool = False
+    is_sanitizing: bool = True
+    wait_till_complete: bool = True
+    batch_size: Union[int, None] = None
+    write_parallelism: Union[int, None] = None
+    compression: Union[str, None] = None
+    enable_dictionary: bool = True
+    speculative_download: bool = False
 
-    @is_replacing.setter
-    def is_replacing(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__is_replacing = val
-        return
 
-    @property
-    def working_dir(self):
-        return self.__working_dir
+def _execute_ingest_data(props, saved_file_name, ingested_date, file_sha512, sha512_result, sha512_cause, db_io=None):
+    """
+    module level function so that it can be submitted to _INGEST_POOL without pickling IngestAwsJson.
+    db_io is the shared instance of the worker process if it is not given.
+    props.working_dir is removed at the end, so that it is cleaned up in the worker process for background ingestion.
+    """
+    db_io = MetadataTblIO.instance() if db_io is None else db_io
+    try:
+        LOGGER.debug(f'ingesting file: {saved_file_name}')
+        start_time = TimeUtils.get_current_time_unix()
+        start_monotonic = time.monotonic_ns()
+        ingest_new_file = IngestNewJsonFile(props.is_replacing)
+        ingest_new_file.sanitize_record = props.is_sanitizing
+        ingest_new_file.batch_size = props.batch_size
+        ingest_new_file.write_parallelism = props.write_parallelism
+        ingest_new_file.enable_dictionary = props.enable_dictionary
+        if props.compression is not None:
+            ingest_new_file.compression = props.compression
+        num_records = ingest_new_file.ingest(saved_file_name, props.uuid)
+        # duration from the monotonic clock so that a wall clock adjustment cannot put end_time before start_time
+        end_time = start_time + (time.monotonic_ns() - start_monotonic) // 1_000_000
+        LOGGER.debug(f'uploading to metadata table')
+        new_record = {
+            CDMSConstants.s3_url_key: props.s3_url,
+            CDMSConstants.uuid_key: props.uuid,
+            CDMSConstants.ingested_date_key: ingested_date,
+            CDMSConstants.file_size_key: FileUtils.get_size(saved_file_name),
+            CDMSConstants.checksum_key: file_sha512,
+            CDMSConstants.checksum_validation: sha512_result,
+            CDMSConstants.checksum_cause: sha512_cause,
+            CDMSConstants.job_start_key: start_time,
+            CDMSConstants.job_end_key: end_time,
+            CDMSConstants.records_count_key: num_records,
+        }
+        if props.is_replacing:
+            db_io.replace_record(new_record)
+        else:
+            db_io.insert_record(new_record)
+        # TODO make it background process?
+        LOGGER.warning('Disabled tagging S3 due to IAM issues')
+        # LOGGER.debug(f'tagging s3')
+        # s3.add_tags_to_obj({
+        #     'parquet_ingested': TimeUtils.get_time_str(ingested_date),
+        #     'job_id': props.uuid,
+        # })
+    except Exception as e:
+        return {'message': 'failed to ingest to parquet', 'details': str(e)}, 500
+    finally:
+        LOGGER.debug(f'deleting working dir: {props.working_dir}')
+        shutil.rmtree(props.working_dir, ignore_errors=True)
+    if sha512_result is True:
+        return {'message': 'ingested', 'job_id': props.uuid}, 201
+    return {'message': 'ingested, different sha512', 'cause': sha512_cause,
+            'job_id': props.uuid}, 203
 
-    @working_dir.setter
-    def working_dir(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__working_dir = val
-        return
 
-    @property
-    def s3_url(self):
-        return self.__s3_url
+def _submit_ingest_data(*args):
+    """
+    submitting _execute_ingest_data to _INGEST_POOL. the pool is created if it is not created yet.
+    a worker dying abruptly (OOM killed, segfault) breaks the whole pool. so it is re-created, and retried once.
 
-    @s3_url.setter
-    def s3_url(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__s3_url = val
-        return
-
-    @property
-    def uuid(self):
-        return self.__uuid
-
-    @uuid.setter
-    def uuid(self, val):
-        """
-        :param val:
-        :return: None
-        """
-        self.__uuid = val
-        return
+    :param args: arguments of _execute_ingest_data
+    :return: Future
+    """
+    global _INGEST_POOL
+    with _INGEST_POOL_LOCK:
+        if _INGEST_POOL is None:
+            _INGEST_POOL = _new_ingest_pool()
+        ingest_pool = _INGEST_POOL
+    try:
+        return ingest_pool.submit(_execute_ingest_data, *args)
+    except BrokenProcessPool:
+        LOGGER.warning('ingest pool is broken. re-creating it')
+        with _INGEST_POOL_LOCK:
+            if _INGEST_POOL is ingest_pool:  # not re-created by another request yet
+                _INGEST_POOL = _new_ingest_pool()
+                ingest_pool.shutdown(wait=False)
+            ingest_pool = _INGEST_POOL
+        return ingest_pool.submit(_execute_ingest_data, *args)
 
 
 class IngestAwsJson:
-    def __init__(self, props=IngestAwsJsonProps()):
-        self.__props = props
+    def __init__(self, props=None):
+        self.__props = IngestAwsJsonProps() if props is None else props
         self.__saved_file_name = None
         self.__ingested_date = TimeUtils.get_current_time_unix()
         self.__file_sha512 = None
         self.__sha512_result = None
         self.__sha512_cause = None
-        self.__db_io = MetadataTblIO()
+        self.__db_io = MetadataTblIO.instance()
 
-    def __get_s3_sha512(self):
+    @staticmethod
+    def parse_sha512_content(sha512_content: bytes):
         """
         sha512 file is in this format
         <sha-512><space or tab><s3 json filename>
-        :return:
+        the filename is optional. the 1st token is the sha512.
+
+        :param sha512_content: bytes - content of the sha512 file
+        :return: str - sha512 or None if it is empty
+        :raises UnicodeDecodeError: if it is not UTF-8
+        """
+        sha512_tokens = sha512_content.decode('UTF-8').split(None, 1)
+        return sha512_tokens[0] if len(sha512_tokens) > 0 else None
+
+    def __get_s3_sha512(self, s3: AwsS3):
+        """
+        :param s3: AwsS3 - re-using the client of the downloaded file
+        :return: str - sha512 or None if it is missing or empty
         """
         if self.__props.s3_sha_url is None:
             LOGGER.warning(f's3_sha_url is None. using s3_url to generate one')
             self.__props.s3_sha_url = f'{self.__props.s3_url}.sha512'
-        s3 = AwsS3().set_s3_url(self.__props.s3_sha_url)
         try:
-            s3.get_s3_obj_size()
-            sha512_content = s3.read_small_txt_file()
-            return sha512_content.replace(os.path.basename(self.__props.s3_url), '').strip()
-        except:
-            LOGGER.exception(f'cannot find s3_sha_url')
+            return self.parse_sha512_content(s3.get_small_object(self.__props.s3_sha_url))
+        except ClientError as e:
+            # S3 returns AccessDenied instead of NoSuchKey for a missing key without s3:ListBucket permission
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404', 'AccessDenied', '403'):
+                raise
+            LOGGER.warning(f'cannot find s3_sha_url: {self.__props.s3_sha_url}. error code: {e.response["Error"]["Code"]}')
+            return None
+        except UnicodeDecodeError as e:
+            LOGGER.warning(f'invalid sha512 file: {self.__props.s3_sha_url}. details: {str(e)}')
             return None
 
     def __compare_sha512(self, s3_sha512):
@@ -163,7 +220,9 @@ class IngestAwsJson:
             self.__sha512_result = False
             self.__sha512_cause = 'missing S3 sha512'
             return
-        if s3_sha512 == self.__file_sha512:
+        s3_sha512 = s3_sha512.lower()
+        # bytes since compare_digest rejects non-ascii str from a malformed sidecar
+        if self.__file_sha512 is not None and hmac.compare_digest(s3_sha512.encode(), self.__file_sha512.lower().encode()):
             self.__sha512_result = True
             self.__sha512_cause = ''
             return
@@ -171,53 +230,39 @@ class IngestAwsJson:
         self.__sha512_cause = f'mismatched sha512: {s3_sha512} vs {self.__file_sha512}'
         return
 
+    def __validate_existing_record(self, existing_record):
+        """
+        :param existing_record: dict - record of s3_url in the metadata table. None if it is new
+        :return: tuple - (json object, return code) if it cannot be ingested. None otherwise
+        """
+        if existing_record is None and self.__props.is_replacing is True:
+            LOGGER.error(f'unable to replace file as it is new. {self.__props.s3_url}')
+            return {'message': 'unable to replace file as it is new'}, 500
+
+        if existing_record is not None and self.__props.is_replacing is False:
+            LOGGER.error(f'unable to ingest file as it is already ingested. {self.__props.s3_url}. ingested record: {existing_record}')
+            return {'message': 'unable to ingest file as it is already ingested'}, 500
+        return None
+
+    @staticmethod
+    def __abort_download(abort_event, download_future):
+        """
+        aborting the speculative download, and waiting for it to stop
+        so that the working dir is not removed while the file is being written.
+        """
+        abort_event.set()
+        download_error = download_future.exception()
+        LOGGER.debug(f'speculative download is stopped. error: {download_error}')
+        return
+
     def __execute_ingest_data(self):
-        try:
-            LOGGER.debug(f'ingesting file: {self.__saved_file_name}')
-            start_time = TimeUtils.get_current_time_unix()
-            ingest_new_file = IngestNewJsonFile(self.__props.is_replacing)
-            ingest_new_file.sanitize_record = self.__props.is_sanitizing
-            num_records = ingest_new_file.ingest(self.__saved_file_name, self.__props.uuid)
-            end_time = TimeUtils.get_current_time_unix()
-            LOGGER.debug(f'uploading to metadata table')
-            new_record = {
-                CDMSConstants.s3_url_key: self.__props.s3_url,
-                CDMSConstants.uuid_key: self.__props.uuid,
-                CDMSConstants.ingested_date_key: self.__ingested_date,
-                CDMSConstants.file_size_key: FileUtils.get_size(self.__saved_file_name),
-                CDMSConstants.checksum_key: self.__file_sha512,
-                CDMSConstants.checksum_validation: self.__sha512_result,
-                CDMSConstants.checksum_cause: self.__sha512_cause,
-                CDMSConstants.job_start_key: start_time,
-                CDMSConstants.job_end_key: end_time,
-                CDMSConstants.records_count_key: num_records,
-            }
-            if self.__props.is_replacing:
-                self.__db_io.replace_record(new_record)
-            else:
-                self.__db_io.insert_record(new_record)
-            LOGGER.debug(f'deleting used file')
-            FileUtils.del_file(self.__saved_file_name)
-            # TODO make it background process?
-            LOGGER.warning('Disabled tagging S3 due to IAM issues')
-            # LOGGER.debug(f'tagging s3')
-            # s3.add_tags_to_obj({
-            #     'parquet_ingested': TimeUtils.get_time_str(self.__ingested_date),
-            #     'job_id': self.__props.uuid,
-            # })
-        except Exception as e:
-            LOGGER.debug(f'deleting error file')
-            FileUtils.del_file(self.__saved_file_name)
-            return {'message': 'failed to ingest to parquet', 'details': str(e)}, 500
-        if self.__sha512_result is True:
-            return {'message': 'ingested', 'job_id': self.__props.uuid}, 201
-        return {'message': 'ingested, different sha512', 'cause': self.__sha512_cause,
-                'job_id': self.__props.uuid}, 203
+        return _execute_ingest_data(self.__props, self.__saved_file_name, self.__ingested_date,
+                                    self.__file_sha512, self.__sha512_result, self.__sha512_cause, self.__db_io)
 
     def ingest(self):
         """
         - download s3 file
-        - unzip if needed
+        - unzip in memory if needed
         - ingest to parquet
         - update to metadata tbl
         - delete local file
@@ -225,34 +270,53 @@ class IngestAwsJson:
 
         :return: tuple - (json object, return code)
         """
+        is_handed_over = False
+        working_dir = None  # only the directory created by this call is removed
+        self.__props.working_dir = None
         try:
             LOGGER.debug(f'starting to ingest: {self.__props.s3_url}')
-            existing_record = self.__db_io.get_by_s3_url(self.__props.s3_url)
-            if existing_record is None and self.__props.is_replacing is True:
-                LOGGER.error(f'unable to replace file as it is new. {self.__props.s3_url}')
-                return {'message': 'unable to replace file as it is new'}, 500
-
-            if existing_record is not None and self.__props.is_replacing is False:
-                LOGGER.error(f'unable to ingest file as it is already ingested. {self.__props.s3_url}. ingested record: {existing_record}')
-                return {'message': 'unable to ingest file as it is already ingested'}, 500
-
             s3 = AwsS3().set_s3_url(self.__props.s3_url)
-            LOGGER.debug(f'downloading s3 file: {self.__props.uuid}')
-            FileUtils.mk_dir_p(self.__props.working_dir)
-            self.__saved_file_name = s3.download(self.__props.working_dir)
-            self.__file_sha512 = FileUtils.get_checksum(self.__saved_file_name)
-            if self.__saved_file_name.lower().endswith('.gz'):
-                LOGGER.debug(f's3 file is in gzipped form. unzipping. {self.__saved_file_name}')
-                self.__saved_file_name = FileUtils.gunzip_file_os(self.__saved_file_name)
-            self.__compare_sha512(self.__get_s3_sha512())
+            # gzipped files are kept as they are. they are decompressed in memory while ingesting.
+            if self.__props.speculative_download is True:
+                LOGGER.debug(f'downloading s3 file while checking metadata tbl: {self.__props.uuid}')
+                working_dir = tempfile.mkdtemp(prefix='cdms_')
+                self.__props.working_dir = working_dir
+                abort_download = threading.Event()
+                download_executor = ThreadPoolExecutor(max_workers=1)
+                download_future = download_executor.submit(s3.download_with_hash, working_dir,
+                                                           abort_event=abort_download)
+                download_executor.shutdown(wait=False)
+                try:
+                    validation_result = self.__validate_existing_record(self.__db_io.get_by_s3_url(self.__props.s3_url))
+                except Exception:
+                    self.__abort_download(abort_download, download_future)
+                    raise
+                if validation_result is not None:
+                    self.__abort_download(abort_download, download_future)
+                    return validation_result
+                self.__saved_file_name, self.__file_sha512 = download_future.result()
+            else:
+                validation_result = self.__validate_existing_record(self.__db_io.get_by_s3_url(self.__props.s3_url))
+                if validation_result is not None:
+                    return validation_result
+                LOGGER.debug(f'downloading s3 file: {self.__props.uuid}')
+                # not TemporaryDirectory as the directory needs to outlive this method for background ingestion
+                working_dir = tempfile.mkdtemp(prefix='cdms_')
+                self.__props.working_dir = working_dir
+                self.__saved_file_name, self.__file_sha512 = s3.download_with_hash(working_dir)
+            self.__compare_sha512(self.__get_s3_sha512(s3))
+            # _execute_ingest_data removes the working dir once it is handed over
             if self.__props.wait_till_complete is True:
+                is_handed_over = True
                 return self.__execute_ingest_data()
             else:
-                bg_process = Process(target=self.__execute_ingest_data, args=())
-                bg_process.daemon = True
-                bg_process.start()
+                _submit_ingest_data(self.__props, self.__saved_file_name, self.__ingested_date,
+                                    self.__file_sha512, self.__sha512_result, self.__sha512_cause)
+                is_handed_over = True
                 return {'message': 'ingesting. Not waiting.', 'job_id': self.__props.uuid}, 204
         except Exception as e:
-            LOGGER.debug(f'deleting error file')
-            FileUtils.del_file(self.__saved_file_name)
             return {'message': 'failed to ingest to parquet', 'details': str(e)}, 500
+        finally:
+            if is_handed_over is False and working_dir is not None:
+                LOGGER.debug(f'deleting working dir: {working_dir}')
+                shutil.rmtree(working_dir, ignore_errors=True)
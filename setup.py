@@ -47,7 +47,7 @@ setup(
     install_requires=install_requires,
     author="Apache SDAP",
     author_email="dev@sdap.apache.org",
-    python_requires="==3.7",
+    python_requires=">=3.7,<3.10",  # pyspark 3.1.2, gevent 21.8.0 and greenlet 1.1.1. python 3.10+ needs spark >= 3.4 images
     license='NONE',
     include_package_data=True,
 )
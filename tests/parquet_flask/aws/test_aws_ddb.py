@@ -0,0 +1,132 @@
+import os
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from boto3.dynamodb.conditions import Key
+from botocore.stub import Stubber
+
+from parquet_flask.aws.aws_ddb import AwsDdb, AwsDdbProps
+
+
+class TestAwsDdb(unittest.TestCase):
+    def setUp(self):
+        env_patcher = mock.patch.dict(os.environ, {
+            'master_spark_url': 'local', 'spark_app_name': 'test', 'parquet_file_name': 'test.parquet',
+            'in_situ_schema': 'in_situ_schema.json', 'authentication_type': 'file', 'authentication_key': 'test',
+            'parquet_metadata_tbl': 'test_tbl', 'aws_region': 'us-west-2',
+            'aws_access_key_id': 'test', 'aws_secret_access_key': 'test',
+        })
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+        return
+
+    def __new_aws_ddb(self, range_key=None):
+        props = AwsDdbProps()
+        props.tbl_name = 'test_tbl'
+        props.hash_key = 's3_url'
+        props.range_key = range_key
+        return AwsDdb(props)
+
+    def test_replace_decimals(self):
+        aws_ddb = AwsDdb.__new__(AwsDdb)  # skipping __init__ which creates the DDB client
+        self.assertEqual(aws_ddb._replace_decimals(Decimal('2')), 2, 'wrong int')
+        self.assertEqual(type(aws_ddb._replace_decimals(Decimal('2'))), int, 'wrong int type')
+        self.assertEqual(aws_ddb._replace_decimals(Decimal('2.5')), 2.5, 'wrong float')
+        self.assertEqual(aws_ddb._replace_decimals('a'), 'a', 'wrong str')
+        item = {
+            's3_url': 's3://bucket/key',
+            'file_size': Decimal('123'),
+            'nested': {'depth': Decimal('-1.5'), 'list': [Decimal('1'), {'a': Decimal('0.25')}, ['b', Decimal('3')]]},
+        }
+        result = aws_ddb._replace_decimals(item)
+        self.assertIs(result, item, 'not replaced in place')
+        self.assertEqual(result, {
+            's3_url': 's3://bucket/key',
+            'file_size': 123,
+            'nested': {'depth': -1.5, 'list': [1, {'a': 0.25}, ['b', 3]]},
+        }, 'wrong nested result')
+        deep_item = current = {}
+        for _ in range(5000):  # deeper than the default recursion limit
+            current['child'] = {'val': Decimal('1')}
+            current = current['child']
+        aws_ddb._replace_decimals(deep_item)
+        self.assertEqual(type(current['val']), int, 'deeply nested decimal is not replaced')
+        return
+
+    def test_scan_tbl(self):
+        aws_ddb = self.__new_aws_ddb()
+        scan_params = {
+            'TableName': 'test_tbl',
+            'Segment': 0,
+            'TotalSegments': 1,
+            'ScanFilter': {'s3_url': {'AttributeValueList': [{'S': 's3://a'}], 'ComparisonOperator': 'EQ'},
+                           'depth': {'ComparisonOperator': 'NOT_NULL'}},
+            'Select': 'ALL_ATTRIBUTES',
+            'Limit': 1000,
+        }
+        with Stubber(aws_ddb._ddb_client) as ddb_stubber:
+            ddb_stubber.add_response('scan', {
+                'Items': [{'s3_url': {'S': 's3://a'}, 'file_size': {'N': '12'}}],
+                'LastEvaluatedKey': {'s3_url': {'S': 's3://a'}},
+            }, scan_params)
+            ddb_stubber.add_response('scan', {
+                'Items': [{'s3_url': {'S': 's3://a'}, 'depth': {'N': '1.5'}}],
+            }, {**scan_params, 'ExclusiveStartKey': {'s3_url': {'S': 's3://a'}}})
+            result = aws_ddb.scan_tbl({'s3_url': {'AttributeValueList': ['s3://a'], 'ComparisonOperator': 'EQ'},
+                                       'depth': {'ComparisonOperator': 'NOT_NULL'}}, parallel_segments=1)
+            ddb_stubber.assert_no_pending_responses()
+        self.assertEqual(result, [{'s3_url': 's3://a', 'file_size': 12}, {'s3_url': 's3://a', 'depth': 1.5}], 'wrong scan result')
+        return
+
+    def test_add_items_with_range_key(self):
+        aws_ddb = self.__new_aws_ddb(range_key='uuid')
+        items = [{'file_size': 1}, {'file_size': 2}]
+        # the stubber of the table client sees the parameters before they are serialized
+        with Stubber(aws_ddb._ddb_resource.meta.client) as ddb_stubber, \
+                mock.patch.object(aws_ddb._table, 'batch_writer', wraps=aws_ddb._table.batch_writer) as batch_writer:
+            ddb_stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': {'test_tbl': [
+                {'PutRequest': {'Item': {'file_size': 1, 's3_url': 's3://a', 'uuid': 'job_1'}}},
+                {'PutRequest': {'Item': {'file_size': 2, 's3_url': 's3://a', 'uuid': 'job_2'}}},
+            ]}})
+            aws_ddb.add_items(items, lambda _: 's3://a', lambda k: f'job_{k["file_size"]}')
+            ddb_stubber.assert_no_pending_responses()
+        batch_writer.assert_called_once_with(overwrite_by_pkeys=['s3_url', 'uuid'])
+        return
+
+    def test_query_items(self):
+        aws_ddb = self.__new_aws_ddb()
+        query_params = {
+            'TableName': 'test_tbl',
+            'KeyConditionExpression': Key('s3_url').eq('s3://a'),  # not serialized yet when the stubber sees it
+            'Select': 'ALL_ATTRIBUTES',
+        }
+        with Stubber(aws_ddb._ddb_resource.meta.client) as ddb_stubber:
+            ddb_stubber.add_response('query', {
+                'Items': [{'s3_url': {'S': 's3://a'}, 'file_size': {'N': '1'}}, {'s3_url': {'S': 's3://a'}, 'file_size': {'N': '2'}}],
+                'LastEvaluatedKey': {'s3_url': {'S': 's3://a'}},
+            }, {**query_params, 'Limit': 3})
+            ddb_stubber.add_response('query', {
+                'Items': [{'s3_url': {'S': 's3://a'}, 'file_size': {'N': '3.5'}}],
+                'LastEvaluatedKey': {'s3_url': {'S': 's3://a'}},
+            }, {**query_params, 'Limit': 1, 'ExclusiveStartKey': {'s3_url': 's3://a'}})
+            result = aws_ddb.query_items(Key('s3_url').eq('s3://a'), limit=3)
+            ddb_stubber.assert_no_pending_responses()
+        self.assertEqual([k['file_size'] for k in result], [1, 2, 3.5], 'wrong query result')
+        return
+
+    def test_has_table_cache(self):
+        aws_ddb = self.__new_aws_ddb()
+        AwsDdb.invalidate_table_cache('test_tbl')
+        self.addCleanup(AwsDdb.invalidate_table_cache, 'test_tbl')
+        tbl_details = {'Table': {'TableName': 'test_tbl', 'TableStatus': 'ACTIVE'}}
+        with Stubber(aws_ddb._ddb_client) as ddb_stubber, \
+                mock.patch('parquet_flask.aws.aws_ddb.time.monotonic', side_effect=[100, 200, 500, 501]):
+            ddb_stubber.add_response('describe_table', tbl_details, {'TableName': 'test_tbl'})
+            self.assertEqual(aws_ddb.has_table()['Table'], tbl_details['Table'], 'wrong table details')
+            self.assertEqual(aws_ddb.has_table()['Table'], tbl_details['Table'], 'wrong cached table details')
+            ddb_stubber.assert_no_pending_responses()
+            ddb_stubber.add_client_error('describe_table', 'ResourceNotFoundException', expected_params={'TableName': 'test_tbl'})
+            self.assertEqual(aws_ddb.has_table(), None, 'expired table details are not retrieved again')
+            ddb_stubber.assert_no_pending_responses()
+        return
@@ -0,0 +1,44 @@
+import hashlib
+import io
+import os
+import threading
+import unittest
+
+from parquet_flask.aws.aws_s3 import _HashingWriter
+
+
+class TestAwsS3(unittest.TestCase):
+    def test_hashing_writer(self):
+        content = os.urandom(3 * 2**20 + 17)
+        chunk_sizes = [1, 0, 7, 2**20, 2**20 + 3, 65536]  # not aligned with the content size
+        output = io.BytesIO()
+        hasher = hashlib.sha512()
+        hashing_writer = _HashingWriter(output, hasher)
+        offset = 0
+        while offset < len(content):
+            for each_size in chunk_sizes:
+                chunk = content[offset: offset + each_size]
+                self.assertEqual(hashing_writer.write(chunk), len(chunk), 'wrong written size')
+                offset += len(chunk)
+        self.assertEqual(output.getvalue(), content, 'wrong written bytes')
+        self.assertEqual(hasher.hexdigest(), hashlib.sha512(content).hexdigest(), 'wrong digest')
+        return
+
+    def test_hashing_writer_memoryview(self):
+        content = b'{"observations": []}' * 1000
+        output = io.BytesIO()
+        hasher = hashlib.sha512()
+        _HashingWriter(output, hasher).write(memoryview(content))
+        self.assertEqual(output.getvalue(), content, 'wrong written bytes')
+        self.assertEqual(hasher.hexdigest(), hashlib.sha512(content).hexdigest(), 'wrong digest')
+        return
+
+    def test_hashing_writer_abort(self):
+        output = io.BytesIO()
+        abort_event = threading.Event()
+        hashing_writer = _HashingWriter(output, hashlib.sha512(), abort_event)
+        hashing_writer.write(b'first chunk')
+        abort_event.set()
+        self.assertRaises(ValueError, hashing_writer.write, b'second chunk')
+        self.assertEqual(output.getvalue(), b'first chunk', 'chunk is written after abort')
+        return
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+
+from pyspark.sql.types import DoubleType, LongType, MapType, StringType
+
+from parquet_flask.io_logic.cdms_schema import CdmsSchema
+
+
+class TestCdmsSchema(unittest.TestCase):
+    def test_get_observation_schema(self):
+        json_schema = {
+            'definitions': {
+                'platform': {'type': 'object', 'properties': {'code': {'type': 'string'}}},
+                'quality': {'type': 'integer'},
+                'observation': {
+                    'type': 'object',
+                    'properties': {
+                        'time': {'type': 'string', 'format': 'date-time'},
+                        'depth': {'type': 'number'},
+                        'depth_quality': {'$ref': '#/definitions/quality'},
+                        'platform': {'$ref': '#/definitions/platform'},
+                        'device': {'description': 'no type'},
+                        'meta': {'type': ['string', 'object']},
+                        'wind_speed': {'type': ['number', 'null']},
+                    },
+                },
+            },
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            schema_path = os.path.join(tmp_dir_name, 'in_situ_schema.json')
+            with open(schema_path, 'w') as ff:
+                json.dump(json_schema, ff)
+            observation_schema = CdmsSchema.get_observation_schema(schema_path)
+            self.assertEqual(observation_schema.fieldNames(), ['time', 'depth', 'depth_quality', 'platform', 'device', 'meta', 'wind_speed'], 'wrong column order')
+            self.assertEqual(observation_schema['time'].dataType, StringType(), 'wrong string type')
+            self.assertEqual(observation_schema['depth'].dataType, DoubleType(), 'wrong number type')
+            self.assertEqual(observation_schema['depth_quality'].dataType, LongType(), 'wrong $ref integer type')
+            self.assertEqual(observation_schema['platform'].dataType, MapType(StringType(), StringType()), 'wrong $ref object type')
+            self.assertEqual(observation_schema['device'].dataType, StringType(), 'wrong default type')
+            self.assertEqual(observation_schema['meta'].dataType, StringType(), 'wrong mixed type')
+            self.assertEqual(observation_schema['wind_speed'].dataType, DoubleType(), 'wrong nullable number type')
+            self.assertTrue(all(k.nullable for k in observation_schema.fields), 'columns should be nullable')
+            self.assertIs(CdmsSchema.get_observation_schema(schema_path), observation_schema, 'schema is not cached')
+            self.assertEqual(CdmsSchema.get_json_str_columns(schema_path), ('meta',), 'wrong json string columns')
+            observations = [
+                {'time': '2017-01-01T00:00:00Z', 'meta': {'id': 'a', 'flags': [1, 2]}},
+                {'time': '2017-01-01T00:00:00Z', 'meta': 'plain text'},
+                {'time': '2017-01-01T00:00:00Z', 'meta': None},
+                {'time': '2017-01-01T00:00:00Z'},
+            ]
+            CdmsSchema.serialize_json_str_columns(observations, schema_path)
+            self.assertEqual(json.loads(observations[0]['meta']), {'id': 'a', 'flags': [1, 2]}, 'object meta is not serialized')
+            self.assertEqual(observations[1]['meta'], 'plain text', 'string meta should not be changed')
+            self.assertEqual(observations[2]['meta'], None, 'null meta should not be changed')
+            self.assertNotIn('meta', observations[3], 'missing meta should not be added')
+        return
+
+    def test_get_observation_schema_invalid_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            schema_path = os.path.join(tmp_dir_name, 'invalid_schema.json')
+            with open(schema_path, 'w') as ff:
+                ff.write('{"definitions": ')
+            self.assertRaises(ValueError, CdmsSchema.get_observation_schema, schema_path)
+        return
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import tempfile
+import unittest
+
+from parquet_flask.utils.file_utils import FileUtils
+
+
+class TestFileUtils(unittest.TestCase):
+    def test_get_checksum(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            file_path = os.path.join(tmp_dir_name, 'sample.json')
+            content = os.urandom(3 * 2**20 + 123)
+            with open(file_path, 'wb') as ff:
+                ff.write(content)
+            self.assertEqual(FileUtils.get_checksum(file_path), hashlib.sha512(content).hexdigest(), 'wrong checksum')
+        return
+
+    def test_get_checksum_fast(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            file_path = os.path.join(tmp_dir_name, 'sample.json')
+            content = os.urandom(3 * 2**20 + 123)
+            with open(file_path, 'wb') as ff:
+                ff.write(content)
+            shard_size = -(-len(content) // 4)
+            expected = hashlib.sha512(b''.join([hashlib.sha512(content[k: k + shard_size]).digest() for k in range(0, len(content), shard_size)])).hexdigest()
+            self.assertEqual(FileUtils.get_checksum_fast(file_path, 4), expected, 'wrong checksum')
+            self.assertEqual(FileUtils.get_checksum_fast(file_path, 1), hashlib.sha512(hashlib.sha512(content).digest()).hexdigest(), 'wrong checksum for 1 shard')
+        return
+
+    def test_get_checksum_unknown_algorithm(self):
+        self.assertRaises(ValueError, FileUtils.get_checksum, __file__, 'md4')
+        return
+
+    def test_gunzip_file_os(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            zipped_file_path = os.path.join(tmp_dir_name, 'sample.json.gz')
+            content = b'{"observations": []}' * 100000
+            with gzip.open(zipped_file_path, 'wb') as ff:
+                ff.write(content)
+            output_file_path = FileUtils.gunzip_file_os(zipped_file_path)
+            self.assertEqual(output_file_path, os.path.join(tmp_dir_name, 'sample.json'), 'wrong output path')
+            self.assertFalse(FileUtils.file_exist(zipped_file_path), 'zipped file is not deleted')
+            with open(output_file_path, 'rb') as ff:
+                self.assertEqual(ff.read(), content, 'wrong content')
+        return
+
+    def test_read_write_json(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            file_path = os.path.join(tmp_dir_name, 'sample.json')
+            json_obj = {'provider': 'a', 'project': 'b', 'observations': [{'depth': 1.5, 'time': '2017-01-01T00:00:00Z'}]}
+            FileUtils.write_json(file_path, json_obj)
+            self.assertEqual(FileUtils.read_json(file_path), json_obj, 'wrong json')
+            self.assertRaises(ValueError, FileUtils.write_json, file_path, json_obj)
+            FileUtils.write_json(file_path, json_obj, overwrite=True, prettify=True)
+            self.assertEqual(FileUtils.read_json(file_path), json_obj, 'wrong prettified json')
+            with open(file_path, 'w') as ff:
+                ff.write('{"depth": NaN}')
+            self.assertTrue(math.isnan(FileUtils.read_json(file_path)['depth']), 'NaN is not parsed')
+            FileUtils.write_json(file_path, {'depth': float('nan'), 'meta': None, 1: 'a'}, overwrite=True)
+            json_obj = FileUtils.read_json(file_path)
+            self.assertTrue(math.isnan(json_obj['depth']), 'NaN is not written')
+            self.assertEqual(json_obj['meta'], None, 'wrong null')
+            self.assertEqual(json_obj['1'], 'a', 'wrong non-str key')
+            FileUtils.write_json(file_path, {'b': 'nullable', 'c': [1, None]}, overwrite=True)
+            with open(file_path, 'rb') as ff:
+                self.assertEqual(ff.read(), b'{"b":"nullable","c":[1,null]}', 'json should be compact')
+            FileUtils.write_json(file_path, {'depth': [float('inf')], 'é': 1}, overwrite=True)
+            with open(file_path, 'rb') as ff:
+                self.assertEqual(ff.read(), '{"depth":[Infinity],"é":1}'.encode(), 'json with Infinity should be compact')
+            with open(file_path, 'w') as ff:
+                ff.write('{"depth": ')
+            self.assertEqual(FileUtils.read_json(file_path), None, 'invalid json should be None')
+        return
+
+    def test_gunzip_file_os_multi_member(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            zipped_file_path = os.path.join(tmp_dir_name, 'sample.json.gz')
+            with open(zipped_file_path, 'wb') as ff:
+                ff.write(gzip.compress(b'{"observations": '))
+                ff.write(gzip.compress(b'[]}'))
+            output_file_path = FileUtils.gunzip_file_os(zipped_file_path)
+            with open(output_file_path, 'rb') as ff:
+                self.assertEqual(ff.read(), b'{"observations": []}', 'wrong content')
+            truncated_file_path = os.path.join(tmp_dir_name, 'truncated.json.gz')
+            with open(truncated_file_path, 'wb') as ff:
+                ff.write(gzip.compress(b'{"observations": []}' * 1000)[:-10])
+            self.assertRaises(ValueError, FileUtils.gunzip_file_os, truncated_file_path)
+            self.assertTrue(FileUtils.file_exist(truncated_file_path), 'zipped file is deleted after failure')
+            self.assertFalse(FileUtils.file_exist(truncated_file_path[:-3]), 'partial output is not deleted')
+        return
+
+    def test_gunzip_file_os_missing_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            self.assertRaises(ValueError, FileUtils.gunzip_file_os, os.path.join(tmp_dir_name, 'missing.json.gz'))
+        return
+
+    def test_read_json_gzipped(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            file_path = os.path.join(tmp_dir_name, 'sample.json.gz')
+            json_obj = {'provider': 'a', 'project': 'b', 'observations': [{'depth': 1.5}]}
+            with gzip.open(file_path, 'wb') as ff:
+                ff.write(json.dumps(json_obj).encode())
+            self.assertEqual(FileUtils.read_json(file_path), json_obj, 'wrong json')
+            with open(file_path, 'wb') as ff:
+                ff.write(b'not gzipped')
+            self.assertEqual(FileUtils.read_json(file_path), None, 'invalid gzip should be None')
+        return
+
+    def test_read_json_missing_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            self.assertRaises(FileNotFoundError, FileUtils.read_json, os.path.join(tmp_dir_name, 'missing.json'))
+            self.assertRaises(FileNotFoundError, FileUtils.read_json, os.path.join(tmp_dir_name, 'missing.json.gz'))
+        return
@@ -0,0 +1,16 @@
+import unittest
+
+from parquet_flask.v1.ingest_aws_json import IngestAwsJson
+
+
+class TestIngestAwsJson(unittest.TestCase):
+    def test_parse_sha512_content(self):
+        sha512 = 'ab' * 64
+        self.assertEqual(IngestAwsJson.parse_sha512_content(f'{sha512}  sample.json.gz\n'.encode()), sha512, 'wrong sha512 with space')
+        self.assertEqual(IngestAwsJson.parse_sha512_content(f'{sha512}\tsample.json\n'.encode()), sha512, 'wrong sha512 with tab')
+        self.assertEqual(IngestAwsJson.parse_sha512_content(f'{sha512} *sub_dir/sample.json'.encode()), sha512, 'wrong sha512 with binary marker')
+        self.assertEqual(IngestAwsJson.parse_sha512_content(f'\n{sha512}'.encode()), sha512, 'wrong sha512 without filename')
+        self.assertEqual(IngestAwsJson.parse_sha512_content(b''), None, 'empty file should be None')
+        self.assertEqual(IngestAwsJson.parse_sha512_content(b' \n\t'), None, 'blank file should be None')
+        self.assertRaises(UnicodeDecodeError, IngestAwsJson.parse_sha512_content, b'\xff\xfe')
+        return